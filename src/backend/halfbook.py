@@ -1,93 +1,174 @@
-import bisect
 from dataclasses import dataclass
 from decimal import Decimal
+from functools import lru_cache
+
+from sortedcontainers import SortedDict
+
+
+@lru_cache(maxsize=4096)
+def _D(price: str) -> Decimal:
+    """
+    Cached Decimal(price): prices move on a fixed tick grid, so the same few hundred strings come up again and again.
+    """
+    return Decimal(price)
+
+
+def _decimal_places(price: str) -> int:
+    """
+    Returns the number of significant decimal places in a price string, e.g. 2 for '301.15' and 1 for '301.10'.
+    """
+    return len(price.partition('.')[2].rstrip('0'))
+
+
+def _to_ticks(price: str, scale: int) -> int:
+    """
+    Converts a price string to an integer number of ticks, i.e. price * 10^scale.
+    Assumes price has at most scale significant decimal places.
+    """
+    whole, _, frac = price.partition('.')
+    if len(frac) != scale:
+        frac = frac.rstrip('0').ljust(scale, '0')
+    return int(whole + frac)
 
 
 class Halfbook:
+    __slots__ = ('is_bid', '_scale', 'halfbook', '_top', '_top_key')
+
     def __init__(self, is_bid: bool):
         self.is_bid = is_bid
-        self.halfbook = []
-        if is_bid:
-            self._sort_key = lambda x: -x[0]
-        else:
-            self._sort_key = lambda x: x[0]
-
-    @classmethod
-    def create(cls, halfbook: list[tuple[Decimal, str]], is_bid: bool, need_sort: bool = False) -> 'Halfbook':
-        """
-        Creates a new Halfbook using a copy of the given halfbook list.
-        """
-        hb = Halfbook(is_bid)
-        if need_sort:
-            hb.set_decimal(halfbook)
-        else:
-            hb.halfbook = halfbook[:]
-        return hb
+        # number of decimal places covered by the integer tick keys
+        self._scale = 0
+        # signed tick -> (price, qty). Bid ticks are negated, so the best price is always the first item.
+        self.halfbook = SortedDict()
+        # memoized best level and its key, None if it has to be looked up again
+        self._top = None
+        self._top_key = 0
 
     def copy(self) -> 'Halfbook':
-        return Halfbook.create(self.halfbook, self.is_bid, need_sort=False)
+        """
+        Returns an independent copy. Levels are immutable tuples, so they can be shared: no need for deepcopy.
+        """
+        hb = Halfbook(self.is_bid)
+        hb._scale = self._scale
+        hb.halfbook = self.halfbook.copy()
+        hb._top, hb._top_key = self._top, self._top_key
+        return hb
+
+    def _signed(self, tick: int) -> int:
+        return -tick if self.is_bid else tick
+
+    def _rescale(self, scale: int):
+        """
+        Increases the number of decimal places the tick keys represent, e.g. when a price finer than all previous ones arrives.
+        """
+        factor = 10 ** (scale - self._scale)
+        self.halfbook = SortedDict({key * factor: level for key, level in self.halfbook.items()})
+        self._scale = scale
+        self._top = None
 
     def set(self, halfbook: list[list[str]]):
         """
         Sets up self.halfbook using given halfbook, that has prices in str format.
         Assumes given halfbook is not sorted.
         """
-        self.halfbook = sorted([(Decimal(price), size) for price, size in halfbook], key=self._sort_key)
+        self._scale = max((_decimal_places(price) for price, _ in halfbook), default=0)
+        self.halfbook = SortedDict({self._signed(_to_ticks(price, self._scale)): (_D(price), size) for price, size in halfbook})
+        self._top = None
 
     def set_decimal(self, halfbook: list[tuple[Decimal, str]]):
         """
         Sets up self.halfbook using given halfbook, that has prices in Decimal format.
         Assumes given halfbook is not sorted.
         """
-        self.halfbook = sorted([(price, size) for price, size in halfbook], key=self._sort_key)
+        self._scale = max((max(0, -price.as_tuple().exponent) for price, _ in halfbook), default=0)
+        self.halfbook = SortedDict({self._signed(int(price.scaleb(self._scale))): (price, size) for price, size in halfbook})
+        self._top = None
 
     def get(self) -> list[tuple[Decimal, str]]:
-        return self.halfbook
-
-    def _get_idx(self, price: Decimal) -> int:
-        search_key = -price if self.is_bid else price
-        return bisect.bisect_left(self.halfbook, search_key, key=self._sort_key)
+        return list(self.halfbook.values())
 
     def get_qty_decimal(self, price: Decimal):
         """
         Returns the qty as str for price. Empty string if not found.
         Price should be Decimal.
         """
-        index = self._get_idx(price)
-
-        if index < len(self.halfbook) and self.halfbook[index][0] == price:
-            return self.halfbook[index][1]
-        return ''
+        tick = price.scaleb(self._scale)
+        if tick != tick.to_integral_value():
+            # finer than any price level we have
+            return ''
+        level = self.halfbook.get(self._signed(int(tick)))
+        return level[1] if level else ''
 
     def get_qty(self, price: str) -> str:
         """
         Returns the qty as str for price. Empty string if not found
         """
-        return self.get_qty_decimal(Decimal(price))
+        if _decimal_places(price) > self._scale:
+            return ''
+        level = self.halfbook.get(self._signed(_to_ticks(price, self._scale)))
+        return level[1] if level else ''
+
+    def top(self) -> tuple[Decimal, str] | None:
+        """
+        Returns the best bid/ask level, None if the halfbook is empty.
+        """
+        if self._top is None and self.halfbook:
+            self._top_key, self._top = self.halfbook.peekitem(0)
+        return self._top
 
     def top_n(self, n: int) -> list[tuple[Decimal, str]]:
         """
         Returns the top n bids/asks.
         """
-        return self.halfbook[:n]
+        return self.halfbook.values()[:n]
 
     def update(self, price: str, qty: str):
-        price_decimal = Decimal(price)
-        index = self._get_idx(price_decimal)
-        if index < len(self.halfbook) and self.halfbook[index][0] == price_decimal:
-            # Update existing entry
-            if Decimal(qty):
-                self.halfbook[index] = (price_decimal, qty)
-            else:
-                del self.halfbook[index]
-        elif Decimal(qty):
-            # Insert new entry
-            bisect.insort(self.halfbook, (price_decimal, qty), key=self._sort_key)
-        else:
-            print(f'Warning: asked to delete price level that does not exist: {price}')
+        self.update_many(((price, qty),))
+
+    def update_many(self, updates: list[list[str]]):
+        """
+        Applies the given [price, qty] updates in order, prices and qtys in str format. A qty of zero deletes the price level.
+        Same as calling update() for each of them, without the per-level call overhead.
+        """
+        book = self.halfbook
+        scale = self._scale
+        is_bid = self.is_bid
+        for price, qty in updates:
+            whole, _, frac = price.partition('.')
+            if len(frac) != scale:
+                # slow path: price has a different number of decimal places than our ticks
+                places = _decimal_places(price)
+                if places > scale:
+                    self._rescale(places)
+                    book = self.halfbook
+                    scale = self._scale
+                frac = frac.rstrip('0').ljust(scale, '0')
+            tick = int(whole + frac)
+            key = -tick if is_bid else tick
+            if key <= self._top_key:
+                # the best level changes
+                self._top = None
+
+            if qty.strip('0.'):
+                # non-zero qty ('0', '0.00' etc. strip to nothing): no need to parse it as a Decimal
+                level = book.get(key)
+                if level:
+                    # Update existing entry: the set of keys is unchanged, so the sorted key list can be bypassed
+                    dict.__setitem__(book, key, (level[0], qty))
+                else:
+                    # Insert new entry
+                    book[key] = (_D(price), qty)
+            elif book.pop(key, None) is None:
+                print(f'Warning: asked to delete price level that does not exist: {price}')
 
     def __getitem__(self, i):
-        return self.halfbook[i]
+        return self.halfbook.values()[i]
+
+    def __iter__(self):
+        return iter(self.halfbook.values())
+
+    def __len__(self):
+        return len(self.halfbook)
 
 
 @dataclass
@@ -0,0 +1,20 @@
+from typing import BinaryIO, Iterator
+
+READ_SIZE = 1 << 20
+
+
+def iter_lines(f: BinaryIO, read_size: int = READ_SIZE) -> Iterator[bytes]:
+    """
+    Yields the lines of binary file f from its current position on, without the trailing newline.
+    Reads read_size chunks and splits them in memory: a lot fewer io calls than iterating the file line by line.
+    """
+    tail = b''
+    while True:
+        chunk = f.read(read_size)
+        if not chunk:
+            break
+        lines = (tail + chunk).split(b'\n')
+        tail = lines.pop()
+        yield from lines
+    if tail:
+        yield tail
@@ -4,12 +4,12 @@ import sys
 import re
 import time
 from contextlib import contextmanager
-from copy import copy
 from typing import Callable
 
 from termcolor import colored
 
 LOG_LEVELS = ('CRITICAL', 'FATAL', 'ERROR', 'WARN', 'WARNING', 'INFO', 'DEBUG', 'NOTSET')
+_LEVEL_NUMBERS = {level: logging.getLevelName(level) for level in LOG_LEVELS[:-1]}
 
 
 class NoColorFormatter(logging.Formatter):
@@ -28,9 +28,16 @@ class NoColorFormatter(logging.Formatter):
 
     def format(self, record: logging.LogRecord):
         """Return logger message with terminal escapes removed."""
-        my_record = copy(record)
-        my_record.msg = re.sub(self.ANSI_RE, "", str(my_record.msg))
-        return self.formatter.format(my_record)
+        msg = str(record.msg)
+        if '\x1b' not in msg:
+            return self.formatter.format(record)
+        # strip escapes in place (restoring afterwards) rather than copying the record
+        original_msg = record.msg
+        record.msg = self.ANSI_RE.sub("", msg)
+        try:
+            return self.formatter.format(record)
+        finally:
+            record.msg = original_msg
 
 
 def create_logger():
@@ -122,6 +129,15 @@ def set_file_loglevel(level: str) -> None:
         logger.handlers[1].setLevel(level)
 
 
+def log_enabled(level: str = 'INFO') -> bool:
+    """
+    Returns whether a message logged at the given level would be emitted by any handler.
+    """
+    levelno = _LEVEL_NUMBERS.get(level.upper(), logging.DEBUG)
+    # the root logger passes everything on, it's the handlers that filter
+    return logger.isEnabledFor(levelno) and any(levelno >= handler.level for handler in logger.handlers)
+
+
 def log(*msg, level: str = 'INFO', color: str = None):
     if 'pytest' in sys.modules:
         # we're running in pytest, no need for logfiles (and coloring)
@@ -130,13 +146,16 @@ def log(*msg, level: str = 'INFO', color: str = None):
         else:
             print(*msg)
     else:
+        if not log_enabled(level):
+            return
+        levelno = _LEVEL_NUMBERS.get(level.upper(), logging.DEBUG)
         str_msg = [str(item) for item in msg]
         final_msg = " ".join(str_msg)
         lines = final_msg.split('\n')
         for line in lines:
             if color:
                 line = colored(line, color=color)
-            getattr(logger, level.lower(), logger.debug)(msg=line)
+            logger.log(levelno, line)
 
 def log_with_color_scale(*msg, value, thresholds: list[float], colors: list[str] = ('red', 'yellow', 'green'), level: str = 'DEBUG'):
     color = colors[-1]
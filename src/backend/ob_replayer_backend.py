@@ -1,17 +1,20 @@
 import datetime
 import os
+import threading
 
-from fastapi import FastAPI, HTTPException, Request
+import orjson
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse
 from pydantic import BaseModel
 
-from .halfbook import Orderbook
 from .orderbook_traverser import OrderbookTraverser
-from .helpers.logger import log, set_logfile
+from .helpers.logger import log, log_enabled, set_logfile
 
-app = FastAPI(title="Order Book History Viewer")
+MAX_LOGGED_BODY_BYTES = 2048
+
+app = FastAPI(title="Order Book History Viewer", default_response_class=ORJSONResponse)
 # Mount the frontend directory
 app.mount("/src/frontend", StaticFiles(directory="src/frontend"), name="frontend")
 
@@ -38,49 +41,89 @@ class OrderbookService:
         self.current_history: OrderbookTraverser | None = None
         self.current_symbol: str | None = None
         self.current_date: datetime.date | None = None
+        # endpoints run in FastAPI's threadpool: a move and the snapshot taken after it must not interleave with another request
+        self._lock = threading.Lock()
+        # (timestamp, serialized orderbook) of the last response, reused while the replay stays at that timestamp
+        self._last_response: tuple[int, bytes] | None = None
+        # date -> (mtime of the orderbook directory, markets available on that date)
+        self._markets_cache: dict[datetime.date, tuple[int, list[str]]] = {}
 
     def _assert_history(self):
         if not self.current_history:
             raise HTTPException(status_code=400, detail="No market selected")
 
+    def _snapshot(self) -> Response:
+        """
+        Returns the current orderbook serialized as JSON (an OrderbookResponse). Call with self._lock held.
+        """
+        timestamp = self.current_history.current_timestamp
+        if self._last_response is None or self._last_response[0] != timestamp:
+            # straight to JSON: no pydantic validation, no jsonable_encoder walk over every level
+            self._last_response = (timestamp, orjson.dumps(self.current_history.get_orderbook().__dict__))
+        return Response(content=self._last_response[1], media_type='application/json')
+
     def available_markets(self, date_: datetime.date) -> list[str]:
         data_dir = './orderbooks'
-        os.makedirs(data_dir, exist_ok=True)
-        return [f.split('_')[1] for f in os.listdir(data_dir) if date_.strftime('%Y-%m-%d') in f and f.endswith('.data')]
+        try:
+            mtime = os.stat(data_dir).st_mtime_ns
+        except FileNotFoundError:
+            os.makedirs(data_dir, exist_ok=True)
+            mtime = os.stat(data_dir).st_mtime_ns
+
+        cached = self._markets_cache.get(date_)
+        if cached and cached[0] == mtime:
+            # no files were added, removed or renamed since we last looked
+            return cached[1]
+
+        date_str = date_.strftime('%Y-%m-%d')
+        with os.scandir(data_dir) as entries:
+            markets = [entry.name.split('_')[1] for entry in entries if date_str in entry.name and entry.name.endswith('.data')]
+        self._markets_cache[date_] = (mtime, markets)
+        return markets
 
     def select_market(self, symbol: str, date_: datetime.date):
         filename = f'./orderbooks/{date_.strftime("%Y-%m-%d")}_{symbol}_ob20.data'
         if not os.path.exists(filename):
             raise HTTPException(status_code=404, detail="Market data not found")
 
-        self.current_history = OrderbookTraverser(symbol=symbol, filename=filename)
-        self.current_symbol = symbol
-        self.current_date = date_
+        history = OrderbookTraverser(symbol=symbol, filename=filename)
+        with self._lock:
+            previous_history, self.current_history = self.current_history, history
+            self.current_symbol = symbol
+            self.current_date = date_
+            self._last_response = None
+            if previous_history:
+                # release its memory-mapped file
+                previous_history.close()
 
-    def step(self) -> Orderbook:
-        self._assert_history()
+    def step(self) -> Response:
+        with self._lock:
+            self._assert_history()
 
-        self.current_history.step()
-        return self.current_history.get_orderbook()
+            self.current_history.step()
+            return self._snapshot()
 
-    def skip(self, delta: float) -> Orderbook:
-        self._assert_history()
+    def skip(self, delta: float) -> Response:
+        with self._lock:
+            self._assert_history()
 
-        self.current_history.skip(delta)
-        return self.current_history.get_orderbook()
+            self.current_history.skip(delta)
+            return self._snapshot()
 
-    def reset(self) -> Orderbook:
-        self._assert_history()
+    def reset(self) -> Response:
+        with self._lock:
+            self._assert_history()
 
-        self.current_history.reset()
-        return self.current_history.get_orderbook()
+            self.current_history.reset()
+            return self._snapshot()
 
-    def goto(self, dt: datetime.datetime) -> Orderbook:
-        self._assert_history()
+    def goto(self, dt: datetime.datetime) -> Response:
+        with self._lock:
+            self._assert_history()
 
-        timestamp = int(dt.timestamp() * 1000)
-        self.current_history.at(timestamp)
-        return self.current_history.get_orderbook()
+            timestamp = int(dt.timestamp() * 1000)
+            self.current_history.at(timestamp)
+            return self._snapshot()
 
 
 order_book_service = OrderbookService()
@@ -89,10 +132,13 @@ order_book_service = OrderbookService()
 # Custom middleware to log requests
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    try:
-        request_body = await request.json()
-        log(f"Request: {request.method} {request.url} {request_body}")
-    except Exception as e:
+    if not log_enabled('INFO'):
+        return await call_next(request)
+    if request.method != 'GET' and request.headers.get('content-length', '0') != '0':
+        # raw body, not parsed: Starlette caches it, so the endpoint can still read it
+        request_body = await request.body()
+        log(f"Request: {request.method} {request.url} {request_body[:MAX_LOGGED_BODY_BYTES].decode('utf-8', 'replace')}")
+    else:
         log(f"Request: {request.method} {request.url}")
     response = await call_next(request)
     log(f"Response status: {response.status_code}")
@@ -113,33 +159,29 @@ def select_market(market: Market):
 
 @app.get("/step", response_model=OrderbookResponse)
 def get_next_orderbook():
-    orderbook = order_book_service.step()
-    return OrderbookResponse(**orderbook.__dict__)
+    return order_book_service.step()
 
 
-@app.post("/skip")
+@app.post("/skip", response_model=OrderbookResponse)
 def skip_orderbook(req: dict):
     try:
         interval = float(req["seconds"])
-        orderbook = order_book_service.skip(interval)
-        return OrderbookResponse(**orderbook.__dict__)
+        return order_book_service.skip(interval)
     except Exception as e:
         log(f"Error in /skip endpoint: {e}")
         raise HTTPException(status_code=422, detail=str(e))
 
 
-@app.get("/reset")
+@app.get("/reset", response_model=OrderbookResponse)
 def reset():
-    orderbook = order_book_service.reset()
-    return OrderbookResponse(**orderbook.__dict__)
+    return order_book_service.reset()
 
 
-@app.post("/goto")
+@app.post("/goto", response_model=OrderbookResponse)
 def goto_timestamp(req: dict):
     timestamp = float(req['timestamp'])
     dt = datetime.datetime.fromtimestamp(timestamp / 1000.0)
-    orderbook = order_book_service.goto(dt)
-    return OrderbookResponse(**orderbook.__dict__)
+    return order_book_service.goto(dt)
 
 
 # Serve index.html as the default page
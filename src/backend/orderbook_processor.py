@@ -1,10 +1,11 @@
-import json
 from decimal import Decimal
 
 import argparse
+import orjson
 from line_profiler import LineProfiler
 
 from halfbook import Halfbook
+from helpers.jsonl import iter_lines
 
 
 ENABLE_PROFILING = False
@@ -24,31 +25,35 @@ def conditional_profile(enable_profiling):
 @conditional_profile(ENABLE_PROFILING)
 def _calculate_deltas(new_halfbook: list[tuple[Decimal, str]], old_halfbook: list[tuple[Decimal, str]], is_bid: bool) -> list[list[str]]:
     """
-    Calculate the minimal set of deltas needed to update from previous top levels to new top levels
+    Calculate the minimal set of deltas needed to update from previous top levels to new top levels.
+    Both halfbooks are sorted best price first, so they are diffed in a single merge pass.
     """
     changes = []
-    new_levels = set(price for price, _ in new_halfbook)
-    old_levels = set(price for price, _ in old_halfbook)
-
-    added_price_levels = new_levels - old_levels
-    removed_price_levels = old_levels - new_levels
-
-    # create a Halfbook for convenient and fast qty lookups
-    old_hb_object = Halfbook.create(old_halfbook, is_bid, need_sort=False)
-
-    # Add all new/modified levels
-    for price, qty in new_halfbook:
-        if price in removed_price_levels:
-            continue
-        if price in added_price_levels:
-            changes.append([str(price), qty])
+    removals = []
+    i = j = 0
+    new_len, old_len = len(new_halfbook), len(old_halfbook)
+    while i < new_len and j < old_len:
+        new_price, new_qty = new_halfbook[i]
+        old_price, old_qty = old_halfbook[j]
+        if new_price == old_price:
+            # modified level
+            if new_qty != old_qty:
+                changes.append([str(new_price), new_qty])
+            i += 1
+            j += 1
+        elif (new_price > old_price) == is_bid:
+            # new level ahead of the old one: it was added
+            changes.append([str(new_price), new_qty])
+            i += 1
         else:
-            old_qty = old_hb_object.get_qty_decimal(price)
-            if not old_qty or old_qty != qty:
-                changes.append([str(price), qty])
+            # old level ahead of the new one: it was removed
+            removals.append([str(old_price), "0"])
+            j += 1
+    changes.extend([str(price), qty] for price, qty in new_halfbook[i:])
+    removals.extend([str(price), "0"] for price, _ in old_halfbook[j:])
 
     # Add removals for old top levels that are no longer present
-    changes.extend([[str(removed_price), "0"] for removed_price in removed_price_levels])
+    changes.extend(removals)
 
     return changes
 
@@ -57,9 +62,7 @@ def _update_halfbook(halfbook: Halfbook, updates: list[tuple[str, str]]):
     """
     Update the asks/bids state
     """
-    for update in updates:
-        price, qty = update
-        halfbook.update(price=price, qty=qty)
+    halfbook.update_many(updates)
 
 
 class OrderbookProcessor:
@@ -83,19 +86,17 @@ class OrderbookProcessor:
 
         compressed_deltas = {}
         if not self.first_message:
-            # Update full book
+            # Update full book in place, only the previous top levels are kept for diffing
             if data['b']:
-                new_bids = self.bids.copy()
-                _update_halfbook(new_bids, data['b'])
-                bid_deltas = _calculate_deltas(new_bids[: self.max_output_depth], self.bids[: self.max_output_depth], is_bid=True)
-                self.bids = new_bids
+                old_top_bids = self.bids[: self.max_output_depth]
+                _update_halfbook(self.bids, data['b'])
+                bid_deltas = _calculate_deltas(self.bids[: self.max_output_depth], old_top_bids, is_bid=True)
             else:
                 bid_deltas = None
             if data['a']:
-                new_asks = self.asks.copy()
-                _update_halfbook(new_asks, data['a'])
-                ask_deltas = _calculate_deltas(new_asks[: self.max_output_depth], self.asks[: self.max_output_depth], is_bid=False)
-                self.asks = new_asks
+                old_top_asks = self.asks[: self.max_output_depth]
+                _update_halfbook(self.asks, data['a'])
+                ask_deltas = _calculate_deltas(self.asks[: self.max_output_depth], old_top_asks, is_bid=False)
             else:
                 ask_deltas = None
 
@@ -136,21 +137,19 @@ def process_orderbook_file(input_file: str, max_levels: int = 20):
     processor = OrderbookProcessor(max_output_depth=max_levels)
     output_file = input_file.replace('ob500', f'ob{max_levels}')
 
-    with open(input_file, 'r') as f_in, open(output_file, 'w') as f_out:
-        out_strings = []
-        for line_nr, line in enumerate(f_in):
-            message = json.loads(line.strip())
+    with open(input_file, 'rb') as f_in, open(output_file, 'wb') as f_out:
+        out_buf = bytearray()
+        for line_nr, line in enumerate(iter_lines(f_in)):
+            message = orjson.loads(line)
             compressed = processor.process_message(message)
             if compressed:
-                out_strings.append(json.dumps(compressed))
+                out_buf += orjson.dumps(compressed)
+                out_buf += b'\n'
             if not line_nr % 10000:
-                f_out.write('\n'.join(out_strings))
-                f_out.write('\n')
-                out_strings.clear()
+                f_out.write(out_buf)
+                out_buf.clear()
                 print('.', end='')
-        if out_strings:
-            f_out.write('\n'.join(out_strings))
-            f_out.write('\n')
+        f_out.write(out_buf)
 
 
 if __name__ == '__main__':
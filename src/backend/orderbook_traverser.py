@@ -1,10 +1,10 @@
+import bisect
+import mmap
 import os.path
-from copy import deepcopy
-from typing import Optional, Callable
+from typing import Optional
 from decimal import Decimal
-import json
 from dataclasses import dataclass
-from sortedcontainers import SortedDict
+import orjson
 
 from src.backend.halfbook import Orderbook, Halfbook
 
@@ -16,6 +16,9 @@ class OrderbookState:
     timestamp: int
     sequence: int
 
+    def copy(self) -> 'OrderbookState':
+        return OrderbookState(bids=self.bids.copy(), asks=self.asks.copy(), timestamp=self.timestamp, sequence=self.sequence)
+
 
 @dataclass
 class PriceRange:
@@ -31,16 +34,19 @@ class FPCache:
     """
 
     def __init__(self):
-        self.cache = SortedDict()
+        # a plain sorted list + dict beats SortedDict's positional lookups for the few thousand keys we store
+        self.keys: list[int] = []
+        self.values: dict[int, object] = {}
 
     def add(self, key: int, value) -> None:
         """
-        Adds a new key-value pair if key is not already present. A (deep) copy of value is added.
-        If key is already present, does nothing.
+        Adds a new key-value pair if key is not already present. If key is already present, does nothing.
+        Note: value is stored as-is (i.e. no copying!), callers must not mutate it afterwards.
         """
-        if key in self.cache:
+        if key in self.values:
             return
-        self.cache[key] = deepcopy(value)
+        bisect.insort(self.keys, key)
+        self.values[key] = value
 
     def get(self, key: int):
         """
@@ -48,34 +54,30 @@ class FPCache:
         Otherwise the value associated with the largest key smaller than input key, or None if we do not have any keys smaller than input key.
         Note: the cached value is returned as-is (i.e. no copying!)
         """
-        if not self.cache:
-            return None
-        idx = self.cache.bisect_left(key)
-
-        if idx < len(self.cache) and self.cache.peekitem(index=idx)[0] == key:
+        if key in self.values:
             # key is present in cache
-            # print('Cache hit for', key)
-            return self.cache.peekitem(index=idx)[1]
+            return self.values[key]
+        idx = bisect.bisect_left(self.keys, key)
         if idx:
-            # print('Cache miss for', key, '\nItem at idx-1: ', self.cache.peekitem(index=idx - 1))
-            return self.cache.peekitem(index=idx - 1)[1]
+            return self.values[self.keys[idx - 1]]
         return None
 
     def get_closest_key(self, key: int) -> int | None:
         """
         Returns the existing key closest to input key or None if no keys exist.
         """
-        if not self.cache:
+        keys = self.keys
+        if not keys:
             return None
-        idx = self.cache.bisect_left(key)
+        idx = bisect.bisect_left(keys, key)
 
-        if idx < len(self.cache) and self.cache.peekitem(index=idx)[0] == key:
+        if idx < len(keys) and keys[idx] == key:
             return key
         if idx:
-            key_before = self.cache.peekitem(index=idx - 1)[0]
-            if idx == len(self.cache):
+            key_before = keys[idx - 1]
+            if idx == len(keys):
                 return key_before
-            key_after = self.cache.peekitem(index=idx)[0]
+            key_after = keys[idx]
             if key - key_before < key_after - key:
                 return key_before
             return key_after
@@ -97,84 +99,142 @@ class OrderbookTraverser:
         self.current_state: Optional[OrderbookState] = None
         self.current_timestamp = 0  # Logical timestamp, greater or equal to the current orderbook. Smaller than the next delta's timestamp.
 
+        # map the file once: seeking is just setting current_position, the OS pages data in (and keeps it) as we read
+        with open(filename, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
         # Create cache and load initial snapshot
         self.obs_cache = FPCache()
         self._load_initial_snapshot()
         self.initial_timestamp = self.current_timestamp
 
-    def _add_to_cache(self) -> None:
+    def close(self) -> None:
         """
-        Adds the current book to the cache
+        Releases the memory-mapped file. The traverser cannot be used afterwards.
         """
-        self.obs_cache.add(self.current_state.timestamp, (self.current_state, self.current_position))
+        self._mm.close()
 
-    def _add_to_cache_if_needed(self) -> None:
+    def _add_to_cache(self, position: int) -> None:
+        """
+        Adds (a copy of) the current book to the cache, along with the file position right after it
+        """
+        self.obs_cache.add(self.current_state.timestamp, (self.current_state.copy(), position))
+
+    def _add_to_cache_if_needed(self, position: int) -> None:
         """
         Adds the current book to the cache if the last cached book was more than self.cache_frequency_seconds ago
         """
         distance_to_closest_cached_state = abs(self.current_state.timestamp - self.obs_cache.get_closest_key(self.current_state.timestamp))
         if distance_to_closest_cached_state > self.cache_frequency_seconds * 1000:
-            self._add_to_cache()
+            self._add_to_cache(position)
 
     def _load_initial_snapshot(self):
         """
         Load the initial snapshot and store its position
         """
-        with open(self.filename, 'r') as f:
-            first_line = f.readline()
-            data = json.loads(first_line)
-
-            initial_bids = Halfbook(is_bid=True)
-            initial_bids.set(data['b'])
-            initial_asks = Halfbook(is_bid=False)
-            initial_asks.set(data['a'])
+        end = self._mm.find(b'\n')
+        if end == -1:
+            end = len(self._mm)
+        data = orjson.loads(self._mm[:end])
 
-            self.current_state = OrderbookState(bids=initial_bids, asks=initial_asks, timestamp=data['t'], sequence=data['s'])
-            self.current_timestamp = self.current_state.timestamp
+        initial_bids = Halfbook(is_bid=True)
+        initial_bids.set(data['b'])
+        initial_asks = Halfbook(is_bid=False)
+        initial_asks.set(data['a'])
 
-            self.current_position = f.tell()
-            self._add_to_cache()
+        self.current_state = OrderbookState(bids=initial_bids, asks=initial_asks, timestamp=data['t'], sequence=data['s'])
+        self.current_timestamp = self.current_state.timestamp
 
-    def _read_from_current(self, post_iteration_hook: Callable[[dict, dict], bool], hook_ctx: dict) -> None:
-        """
-        Reads deltas from the current position. Terminates when post_iteration_hook returns True
-        Updates state, saves current position, updates cache on every complete (not terminated) iteration.
-        post_iteration_hook's parameters:
-          - hook_ctx (a dict, initialized to empty dict),
-          - current delta loaded from disk
-        """
-        with open(self.filename, 'r') as f:
-            f.seek(self.current_position)
-            while True:
-                line = f.readline()
-                if not line:  # EOF
+        self.current_position = min(end + 1, len(self._mm))
+        self._add_to_cache(self.current_position)
+
+    def _read_until_ts(self, target_ts: int | None = None) -> None:
+        """
+        Reads deltas from the current position until the first delta later than target_ts.
+        If target_ts is None, reads a single set of deltas (the ones with the same timestamp as the first one).
+        Updates state, saves current position, updates cache after every processed delta.
+        """
+        # hot loop: bind methods to locals once instead of looking them up on every delta
+        loads = orjson.loads
+        process_update = self._process_update
+        add_to_cache_if_needed = self._add_to_cache_if_needed
+        mm = self._mm
+        find = mm.find
+        size = len(mm)
+        position = self.current_position
+        try:
+            while position < size:
+                end = find(b'\n', position)
+                if end == -1:
+                    end = size
+                data = loads(mm[position:end])
+                if target_ts is None:
+                    target_ts = data['t']
+                elif data['t'] > target_ts:
                     break
-                data = json.loads(line)
-                terminate = post_iteration_hook(hook_ctx, data)
-                if terminate:
+
+                process_update(data)
+                position = end + 1
+
+                # Update cache
+                add_to_cache_if_needed(position)
+        finally:
+            # position always points right after the last processed delta
+            self.current_position = position
+
+    def _read_until_ts_tracking_extremes(self, target_ts: float, lowest_ask: Decimal, highest_bid: Decimal) -> tuple[Decimal, Decimal]:
+        """
+        Same as _read_until_ts(), but also tracks the lowest best ask and the highest best bid seen along the way,
+        starting from the input values. Returns (lowest_ask, highest_bid).
+        """
+        loads = orjson.loads
+        process_update = self._process_update
+        add_to_cache_if_needed = self._add_to_cache_if_needed
+        # halfbooks are updated in place, so these stay valid throughout the loop
+        bids = self.current_state.bids
+        asks = self.current_state.asks
+        mm = self._mm
+        find = mm.find
+        size = len(mm)
+        position = self.current_position
+        try:
+            while position < size:
+                end = find(b'\n', position)
+                if end == -1:
+                    end = size
+                data = loads(mm[position:end])
+                best_ask = asks.top()[0]
+                if best_ask < lowest_ask:
+                    lowest_ask = best_ask
+                best_bid = bids.top()[0]
+                if best_bid > highest_bid:
+                    highest_bid = best_bid
+                if data['t'] > target_ts:
                     break
 
-                self._process_update(data)
-                self.current_position = f.tell()
+                process_update(data)
+                position = end + 1
 
                 # Update cache
-                self._add_to_cache_if_needed()
+                add_to_cache_if_needed(position)
+        finally:
+            self.current_position = position
+        return lowest_ask, highest_bid
 
     def _process_update(self, data: dict):
         """
         Processes a single update and updates current state
         """
+        state = self.current_state
         # Update bids if present in delta
         if 'b' in data:
-            for price, size in data['b']:
-                self.current_state.bids.update(price=price, qty=size)
+            state.bids.update_many(data['b'])
         # Update asks if present in delta
         if 'a' in data:
-            for price, size in data['a']:
-                self.current_state.asks.update(price=price, qty=size)
+            state.asks.update_many(data['a'])
 
-        self.current_state.timestamp = data['t']
-        self.current_state.sequence = data['s']
+        state.timestamp = data['t']
+        state.sequence = data['s']
 
     def get(self) -> OrderbookState:
         """
@@ -197,17 +257,15 @@ class OrderbookTraverser:
         """
         Gets the current best bid price
         """
-        if self.current_state.bids:
-            return Decimal(self.current_state.bids[0][0])
-        return None
+        top = self.current_state.bids.top()
+        return top[0] if top else None
 
     def get_best_ask(self) -> Decimal | None:
         """
         Gets the current best ask price
         """
-        if self.current_state.asks:
-            return Decimal(self.current_state.asks[0][0])
-        return None
+        top = self.current_state.asks.top()
+        return top[0] if top else None
 
     def skip(self, seconds: float) -> None:
         """
@@ -218,8 +276,13 @@ class OrderbookTraverser:
         target_time = max(self.initial_timestamp, int(self.current_timestamp + (seconds * 1000)))
 
         res = self.obs_cache.get(target_time)
-        if res:
-            self.current_state, self.current_position = deepcopy(res)
+        if self.current_state.timestamp <= target_time and (not res or res[0].timestamp <= self.current_state.timestamp):
+            # no cached state is closer to the target than the current one: read on from here
+            pass
+        elif res:
+            # copy the cached state, as we're about to update it
+            cached_state, self.current_position = res
+            self.current_state = cached_state.copy()
             if self.current_state.timestamp == target_time:
                 # we're exactly where we want to be
                 self.current_timestamp = target_time
@@ -227,7 +290,7 @@ class OrderbookTraverser:
         else:
             self.reset()
 
-        self._read_from_current(post_iteration_hook=lambda hook_ctx, data: data['t'] > target_time, hook_ctx={})
+        self._read_until_ts(target_time)
         self.current_timestamp = target_time
 
     def move(self, seconds: float) -> PriceRange:
@@ -241,20 +304,11 @@ class OrderbookTraverser:
         assert seconds > 0, 'Move only accepts positive intervals!'
         start_time = self.current_timestamp
         # we cannot use the cache here as we need to collect maximum and minimum values
+        target_time = start_time + (seconds * 1000)
+        lowest_ask, highest_bid = self._read_until_ts_tracking_extremes(target_time, self.get_best_ask(), self.get_best_bid())
+        self.current_timestamp = int(target_time)
 
-        def record_extremes_until_target(_hook_ctx: dict, _data: dict) -> bool:
-            _hook_ctx['lowest_ask'] = min(_hook_ctx['lowest_ask'], self.get_best_ask())
-            _hook_ctx['highest_bid'] = max(_hook_ctx['highest_bid'], self.get_best_bid())
-
-            return _data['t'] > _hook_ctx['target_time']
-
-        hook_ctx = {'lowest_ask': self.get_best_ask(), 'highest_bid': self.get_best_bid(), 'target_time': start_time + (seconds * 1000)}
-        self._read_from_current(post_iteration_hook=record_extremes_until_target, hook_ctx=hook_ctx)
-        self.current_timestamp = int(hook_ctx['target_time'])
-
-        return PriceRange(
-            lowest_ask=hook_ctx['lowest_ask'], highest_bid=hook_ctx['highest_bid'], start_time=start_time, end_time=self.current_timestamp
-        )
+        return PriceRange(lowest_ask=lowest_ask, highest_bid=highest_bid, start_time=start_time, end_time=self.current_timestamp)
 
     def at(self, timestamp: int) -> None:
         """
@@ -266,15 +320,7 @@ class OrderbookTraverser:
         """
         Moves one set of deltas ahead (deltas with the same timestamp are in one set)
         """
-
-        def terminate_on_different_ts(hook_ctx: dict, data: dict) -> bool:
-            if 'current_ts' not in hook_ctx:
-                hook_ctx['current_ts'] = data['t']
-            elif data['t'] > hook_ctx['current_ts']:
-                return True
-            return False
-
-        self._read_from_current(post_iteration_hook=terminate_on_different_ts, hook_ctx={})
+        self._read_until_ts()
         self.current_timestamp = self.current_state.timestamp
 
     def reset(self):
@@ -30,23 +30,22 @@ def test_update():
     assert cache.get(1) == 'value1'
 
 
-def test_copy():
+def test_no_copy():
     o = ['a', 11, 'b']
     cache = FPCache()
     cache.add(1, o)
-    o[0] = 'c'
-    cache.add(2, o)
-    assert cache.get(1) == ['a', 11, 'b']
-    assert cache.get(2) == ['c', 11, 'b']
+    assert cache.get(1) is o
+    assert cache.get(2) is o
 
 
-def test_nested_object_copy():
-    o = [[[['a', 11, 'b']]]]
+def test_get_closest_key():
     cache = FPCache()
-    cache.add(1, o)
-    o[0][0][0][0] = 'c'
-    o.append('d')
-    cache.add(2, o)
-    o.append('e')
-    assert cache.get(1) == [[[['a', 11, 'b']]]]
-    assert cache.get(2) == [[[['c', 11, 'b']]], 'd']
+    assert cache.get_closest_key(1) is None
+    cache.add(10, 'value10')
+    cache.add(30, 'value30')
+    cache.add(20, 'value20')
+    assert cache.get_closest_key(20) == 20
+    assert cache.get_closest_key(24) == 20
+    assert cache.get_closest_key(26) == 30
+    assert cache.get_closest_key(100) == 30
+    assert cache.get(25) == 'value20'
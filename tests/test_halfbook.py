@@ -12,9 +12,11 @@ def test_halfbook_bid():
     assert hb.get_qty("100") == "10"
     assert hb.get_qty("102") == ""
     assert hb.top_n(2) == [(Decimal("101"), "15"), (Decimal("100"), "10")]
+    assert hb.top() == (Decimal("101"), "15")
     hb.update("100", "20")
     assert hb.get_qty("100") == "20"
     hb.update("102", "25")
+    assert hb.top() == (Decimal("102"), "25")
     hb.update("99.5", "25")
     hb.update("98", "20")
     assert hb.get() == [
@@ -38,6 +40,7 @@ def test_halfbook_ask():
     assert hb.get_qty("100") == "10"
     assert hb.get_qty("98") == ""
     assert hb.top_n(2) == [(Decimal("99"), "5"), (Decimal("100"), "10")]
+    assert hb.top() == (Decimal("99"), "5")
     hb.update("100", "20")
     assert hb.get_qty("100") == "20"
     hb.update("99.5", "25")
@@ -46,3 +49,48 @@ def test_halfbook_ask():
     assert hb[1:3] == [(Decimal("99.5"), "25"), (Decimal("100"), "20")]
     hb.update("100", "0")
     assert hb.get() == [(Decimal("99"), "5"), (Decimal("99.5"), "25"), (Decimal("101"), "15")]
+    hb.update("99", "7")
+    assert hb.top() == (Decimal("99"), "7")
+    hb.update("99", "0")
+    assert hb.top() == (Decimal("99.5"), "25")
+    hb.update("99.5", "0")
+    hb.update("101", "0")
+    assert hb.top() is None
+
+
+def test_halfbook_copy():
+    hb = Halfbook(is_bid=False)
+    hb.set([["100", "10"], ["99", "5"]])
+    assert hb.top() == (Decimal("99"), "5")
+    hb_copy = hb.copy()
+    hb_copy.update("99", "0")
+    hb_copy.update("101", "15")
+    assert hb.get() == [(Decimal("99"), "5"), (Decimal("100"), "10")]
+    assert hb.top() == (Decimal("99"), "5")
+    assert hb_copy.get() == [(Decimal("100"), "10"), (Decimal("101"), "15")]
+    assert hb_copy.top() == (Decimal("100"), "10")
+
+
+def test_halfbook_mixed_decimal_places():
+    hb = Halfbook(is_bid=True)
+    hb.set([["100.5", "10"], ["100", "5"]])
+    assert hb.get_qty("100.25") == ""
+    assert hb.get_qty_decimal(Decimal("100.25")) == ""
+    hb.update("100.25", "7")
+    assert hb.get() == [(Decimal("100.5"), "10"), (Decimal("100.25"), "7"), (Decimal("100"), "5")]
+    assert str(hb[1][0]) == "100.25"
+    assert hb.get_qty("100.50") == "10"
+    assert hb.get_qty_decimal(Decimal("100")) == "5"
+    hb.update("100.50", "0")
+    assert hb.get() == [(Decimal("100.25"), "7"), (Decimal("100"), "5")]
+    assert len(hb) == 2
+
+
+def test_halfbook_update_many():
+    hb = Halfbook(is_bid=True)
+    hb.set([["100", "10"], ["99", "5"]])
+    hb.update_many([["101", "1"], ["100", "0"], ["99.5", "2"], ["99", "6"]])
+    assert hb.get() == [(Decimal("101"), "1"), (Decimal("99.5"), "2"), (Decimal("99"), "6")]
+    assert hb.top() == (Decimal("101"), "1")
+    hb.update_many([["101", "0.00"], ["99.5", "0.50"]])
+    assert hb.get() == [(Decimal("99.5"), "0.50"), (Decimal("99"), "6")]
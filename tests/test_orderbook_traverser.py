@@ -0,0 +1,160 @@
+from pathlib import Path
+
+import orjson
+import pytest
+
+from src.backend.halfbook import Halfbook
+from src.backend.orderbook_traverser import OrderbookTraverser
+
+FILENAME = str(Path(__file__).parent.parent / 'orderbooks' / '2024-02-03_BNBUSDT_ob20.data')
+
+
+def expected_states(targets: list[int]) -> dict[int, tuple]:
+    """
+    Replays the file from the start, independently of the traverser.
+    Returns (timestamp, sequence, bids, asks, position) for each target timestamp, i.e. the state after every delta up to target.
+    """
+    pending = sorted(set(targets))
+    result = {}
+    bids = Halfbook(is_bid=True)
+    asks = Halfbook(is_bid=False)
+    timestamp = sequence = position = 0
+    with open(FILENAME, 'rb') as f:
+        for line_nr, line in enumerate(f):
+            data = orjson.loads(line)
+            while line_nr and pending and data['t'] > pending[0]:
+                result[pending.pop(0)] = (timestamp, sequence, list(bids), list(asks), position)
+            if not pending:
+                break
+            if line_nr:
+                bids.update_many(data.get('b', []))
+                asks.update_many(data.get('a', []))
+            else:
+                bids.set(data['b'])
+                asks.set(data['a'])
+            timestamp, sequence = data['t'], data['s']
+            position += len(line)
+    for target in pending:
+        result[target] = (timestamp, sequence, list(bids), list(asks), position)
+    return result
+
+
+def expected_range(start_ts: int, target_ts: int) -> tuple:
+    """
+    Returns the (lowest best ask, highest best bid) over every state from the one at start_ts to the one at target_ts.
+    """
+    lowest_ask = highest_bid = None
+    bids = Halfbook(is_bid=True)
+    asks = Halfbook(is_bid=False)
+    with open(FILENAME, 'rb') as f:
+        for line_nr, line in enumerate(f):
+            data = orjson.loads(line)
+            if line_nr and data['t'] > target_ts:
+                break
+            if line_nr:
+                bids.update_many(data.get('b', []))
+                asks.update_many(data.get('a', []))
+            else:
+                bids.set(data['b'])
+                asks.set(data['a'])
+            best_ask, best_bid = asks.top()[0], bids.top()[0]
+            if data['t'] <= start_ts:
+                # not moving yet: only the last of these states (the one at start_ts) counts
+                lowest_ask, highest_bid = best_ask, best_bid
+            else:
+                lowest_ask = min(lowest_ask, best_ask)
+                highest_bid = max(highest_bid, best_bid)
+    return lowest_ask, highest_bid
+
+
+def state_of(traverser: OrderbookTraverser) -> tuple:
+    state = traverser.get()
+    return state.timestamp, state.sequence, list(state.bids), list(state.asks), traverser.current_position
+
+
+@pytest.fixture
+def traverser():
+    t = OrderbookTraverser(symbol='BNBUSDT', filename=FILENAME)
+    yield t
+    t.close()
+
+
+def test_skip_forward(traverser):
+    start = traverser.initial_timestamp
+    targets = []
+    # within the 10s cache interval, then across several intervals (reading on from the current state), then a fraction of a second
+    for seconds in [3, 4, 125, 0.5]:
+        traverser.skip(seconds)
+        targets.append((traverser.current_timestamp, state_of(traverser)))
+    assert [target for target, _ in targets] == [start + 3000, start + 7000, start + 132000, start + 132500]
+
+    expected = expected_states([target for target, _ in targets])
+    for target, state in targets:
+        assert state == expected[target]
+
+
+def test_skip_backward(traverser):
+    start = traverser.initial_timestamp
+    traverser.skip(3600)
+    targets = []
+    # back to a cached state, then a short hop back within a cache interval, then past the initial snapshot
+    for seconds in [-1800, -3, -2.5, -7200]:
+        traverser.skip(seconds)
+        targets.append((traverser.current_timestamp, state_of(traverser)))
+    assert [target for target, _ in targets] == [start + 1800000, start + 1797000, start + 1794500, start]
+
+    expected = expected_states([target for target, _ in targets])
+    for target, state in targets:
+        assert state == expected[target]
+
+
+def test_skip_to_cached_timestamp(traverser):
+    traverser.skip(600)
+    cached_ts = traverser.obs_cache.keys[len(traverser.obs_cache.keys) // 2]
+    traverser.skip(-600)
+    traverser.skip((cached_ts - traverser.current_timestamp) / 1000)
+    assert traverser.current_timestamp == cached_ts
+    assert state_of(traverser) == expected_states([cached_ts])[cached_ts]
+
+
+def test_at(traverser):
+    traverser.skip(900)
+    timestamps = [traverser.initial_timestamp + 1234567, traverser.initial_timestamp + 60000]
+    states = []
+    for timestamp in timestamps:
+        traverser.at(timestamp)
+        states.append((traverser.current_timestamp, state_of(traverser)))
+
+    expected = expected_states([target for target, _ in states])
+    for target, state in states:
+        assert state == expected[target]
+
+
+def test_step(traverser):
+    states = []
+    for _ in range(50):
+        traverser.step()
+        assert traverser.current_timestamp == traverser.get().timestamp
+        states.append((traverser.current_timestamp, state_of(traverser)))
+    # timestamps only move forward, one set of deltas at a time
+    assert len({target for target, _ in states}) == len(states)
+
+    traverser.skip(-1)
+    traverser.step()
+    states.append((traverser.current_timestamp, state_of(traverser)))
+
+    expected = expected_states([target for target, _ in states])
+    for target, state in states:
+        assert state == expected[target]
+
+
+def test_move(traverser):
+    traverser.skip(60)
+    start_ts = traverser.current_timestamp
+    price_range = traverser.move(300)
+    target = start_ts + 300000
+
+    assert price_range.start_time == start_ts
+    assert price_range.end_time == traverser.current_timestamp == target
+    assert state_of(traverser) == expected_states([target])[target]
+    assert (price_range.lowest_ask, price_range.highest_bid) == expected_range(start_ts, target)
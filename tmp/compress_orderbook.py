@@ -1,74 +1,155 @@
 import asyncio
-import json
-from typing import Callable, TextIO
+import os
+import queue as thread_queue
+from typing import Callable
 
 import aiofiles
 import argparse
+import orjson
 
 from orderbook_processor import OrderbookProcessor
 
+try:
+    import uvloop
+except ImportError:  # optional, only makes the event loop faster
+    uvloop = None
+
 CHUNK_LINE_CNT = 10000
+READ_BLOCK_SIZE = 8 << 20
+MAX_QUEUED_BATCHES = 4  # the producer waits when this many batches are unprocessed, capping memory use
+WRITE_BUFFER_SIZE = 1 << 20
 
 
 async def producer(queue: asyncio.Queue, file_path: str):
-    """Asynchronously read a file line by line and put lines into the queue."""
-    async with aiofiles.open(file_path, 'r') as f:
+    """Asynchronously read a file in large blocks and put lines into the queue, in batches of at least CHUNK_LINE_CNT lines."""
+    async with aiofiles.open(file_path, 'rb') as f:
+        # the input is read once, front to back: ask for aggressive readahead, and drop what we have read from the page cache
+        # (instead of evicting everything else on a multi-GB dump)
+        fadvise = getattr(os, 'posix_fadvise', None)
+        if fadvise:
+            fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        offset = 0
         lines = []
-        i = 0
-        async for line in f:
-            i += 1
-            lines.append(line)
-            if i % CHUNK_LINE_CNT == 0:
+        tail = b''
+        while True:
+            # one executor round trip per block instead of per line
+            block = await f.read(READ_BLOCK_SIZE)
+            if not block:
+                break
+            if fadvise:
+                fadvise(f.fileno(), offset, len(block), os.POSIX_FADV_DONTNEED)
+            offset += len(block)
+            block_lines = (tail + block).split(b'\n')
+            tail = block_lines.pop()  # incomplete last line, completed by the next block
+            lines += block_lines
+            if len(lines) >= CHUNK_LINE_CNT:
                 await queue.put(lines)
                 lines = []  # create a new list every time, lines.clear() would mess up the consumer!
+        if tail:
+            lines.append(tail)
+        if lines:
+            await queue.put(lines)
     await queue.put(None)  # Signal that the producer is done
 
 
-async def consumer(queue: asyncio.Queue, infile_path: str, process_fn: Callable[[OrderbookProcessor, str], str], max_levels: int):
-    """Asynchronously process lines from the queue."""
+def writer(output_filepath: str, chunks: thread_queue.Queue):
+    """Writes chunks of output to output_filepath until it gets None. Runs in an executor thread of its own."""
+    with open(output_filepath, 'wb', buffering=WRITE_BUFFER_SIZE) as f_out:
+        while (chunk := chunks.get()) is not None:
+            f_out.write(chunk)
+
+
+async def hand_over(chunks: thread_queue.Queue, chunk: bytearray | None, writer_future: asyncio.Future):
+    """
+    Puts chunk into the writer's queue without blocking the event loop. Waits while the queue is full,
+    raises the writer's exception if it stopped (it would never take the chunk).
+    """
+    while True:
+        if writer_future.done():
+            await writer_future  # raises the writer's exception
+            raise RuntimeError('Writer stopped before the end of the output')
+        try:
+            chunks.put_nowait(chunk)
+            return
+        except thread_queue.Full:
+            # the writer is behind: wake up when it is done or after a while, whichever comes first
+            await asyncio.wait([writer_future], timeout=0.01)
+
+
+async def consumer(queue: asyncio.Queue, output_filepath: str, process_fn: Callable[[OrderbookProcessor, bytes], bytes], max_levels: int):
+    """
+    Asynchronously process lines from the queue.
+    Batches are processed in the default executor, so the event loop keeps reading the input meanwhile. They are still processed
+    one by one, in order: every message updates the processor's book, so batches cannot be processed in parallel.
+    """
+    loop = asyncio.get_running_loop()
     processor = OrderbookProcessor(max_output_depth=max_levels)
-    output_filepath = infile_path.replace('ob500', f'ob{max_levels}')
-    async with aiofiles.open(output_filepath, 'w') as f_out:
+    out_buf = bytearray()
+    lines_processed = 0
+    # a plain file written by a dedicated thread: writes overlap with processing the next batch, no executor hop per write.
+    # The queue is bounded: a slow writer slows the consumer down instead of piling up output in memory
+    chunks = thread_queue.Queue(maxsize=MAX_QUEUED_BATCHES)
+    writer_future = loop.run_in_executor(None, writer, output_filepath, chunks)
+    try:
         while True:
             lines = await queue.get()
             if lines is None:  # Check for the end signal
-                queue.task_done()
+                print()  # end the progress line
                 break
             # Process the lines
-            results = []
-            for line in lines:
-                res = process_fn(processor, line)
-                if res:
-                    results.append(res)
-            if results:
-                await f_out.write('\n'.join(results))
-                await f_out.write('\n')
-            print('.', end='')
-            queue.task_done()
-
-
-def process_line(processor: OrderbookProcessor, line: str) -> str:
-    message = json.loads(line.strip())
+            await loop.run_in_executor(None, process_chunk, processor, lines, process_fn, out_buf)
+            if out_buf:
+                # hand the buffer itself to the writer, no copy: the next batch gets a new one
+                await hand_over(chunks, out_buf, writer_future)
+                out_buf = bytearray()
+            # batches are tens of thousands of lines: reporting each one is cheap, flush so progress actually shows
+            lines_processed += len(lines)
+            print(f'\r{lines_processed} lines processed', end='', flush=True)
+    finally:
+        if not writer_future.done():
+            await hand_over(chunks, None, writer_future)  # Signal that the consumer is done
+        await writer_future  # raises the writer's exception, if any
+
+
+def process_chunk(
+    processor: OrderbookProcessor, lines: list[bytes], process_fn: Callable[[OrderbookProcessor, bytes], bytes], out_buf: bytearray
+) -> None:
+    """Processes a batch of lines, appends the newline terminated output lines to out_buf."""
+    for line in lines:
+        if not line:
+            continue
+        res = process_fn(processor, line)
+        if res:
+            out_buf += res
+            out_buf += b'\n'
+
+
+def process_line(processor: OrderbookProcessor, line: bytes, loads=orjson.loads, dumps=orjson.dumps) -> bytes:
+    # loads and dumps are bound once, at definition time: no global + attribute lookup per line.
+    # orjson's output is already compact bytes: no separators to configure, no encode needed
+    message = loads(line)
     try:
         compressed = processor.process_message(message)
         if compressed:
-            return f'{json.dumps(compressed)}'
+            return dumps(compressed)
     except Exception as e:
         print(f'Failed to process line {line}: {repr(e)}')
-    return ''
+    return b''
 
 
 async def main(file_path: str, max_levels: int):
-    queue = asyncio.Queue()
+    output_filepath = file_path.replace('ob500', f'ob{max_levels}')
+    if output_filepath == file_path:
+        raise ValueError(f'Cannot derive output path from {file_path}: expected an ob500 file (as downloaded from Bybit)')
+
+    queue = asyncio.Queue(maxsize=MAX_QUEUED_BATCHES)
     prod = asyncio.create_task(producer(queue, file_path))
-    cons = asyncio.create_task(consumer(queue, file_path, process_fn=process_line, max_levels=max_levels))
+    cons = asyncio.create_task(consumer(queue, output_filepath, process_fn=process_line, max_levels=max_levels))
 
     print('Started producer and consumer.')
-    await prod
-    print('Waiting for all queue items to be processed...')
-    await queue.join()  # Wait for all items in the queue to be processed
-    print('Cancelling consumer...')
-    cons.cancel()  # Cancel the consumer task
+    # the consumer returns on the producer's end signal, once all its output is written: wait for both to finish,
+    # an exception in either is raised here
+    await asyncio.gather(prod, cons)
     print('Done')
 
 
@@ -78,4 +159,5 @@ if __name__ == "__main__":
     parser.add_argument('-d', '--depth', help='Maximum depth of output orderbook history, default: 20', type=int, default=20)
     args = parser.parse_args()
 
-    asyncio.run(main(args.file, args.depth))
+    run = uvloop.run if uvloop else asyncio.run
+    run(main(args.file, args.depth))